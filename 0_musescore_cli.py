@@ -22,8 +22,8 @@ def convert(
 ):
     """Convert one file with MuseScore command line conversion script."""
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    convert_command = f'"{musescore_command}" -o "{str(out_path.absolute())}" "{str(in_path.absolute())}"'
-    process = subprocess.run(convert_command, stderr=subprocess.PIPE, text=True, shell=True)
+    convert_command = [musescore_command, "-o", str(out_path.absolute()), str(in_path.absolute())]
+    process = subprocess.run(convert_command, stderr=subprocess.PIPE, text=True)
     if not out_path.exists():
         print("Failed to convert: " + str(in_path) + "\n" + process.stderr)
 
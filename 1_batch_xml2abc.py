@@ -1,55 +1,73 @@
 import os
-import random
+import sys
 import argparse
 import subprocess
+import multiprocessing
 from tqdm import tqdm
-from multiprocessing import Pool
-
-def convert_xml2abc(file_list, des_folder):
-    cmd = 'python utils/xml2abc.py -d 8 -c 6 -x '
-    for file in tqdm(file_list):
-        filename = os.path.basename(file)
-        os.makedirs(des_folder, exist_ok=True)
-
-        try:
-            p = subprocess.Popen(cmd + '"' + file + '"', stdout=subprocess.PIPE, shell=True)
-            result = p.communicate()
-            output = result[0].decode('utf-8')
-
-            if output == '':
-                with open("logs/xml2abc_error_log.txt", "a", encoding="utf-8") as f:
-                    f.write(file + '\n')
-                continue
-            else:
-                with open(os.path.join(des_folder, filename.rsplit('.', 1)[0] + '.abc'), 'w', encoding='utf-8') as f:
-                    f.write(output)
-        except Exception as e:
-            with open("logs/xml2abc_error_log.txt", "a", encoding="utf-8") as f:
-                f.write(file + ' ' + str(e) + '\n')
+
+EASYABC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'EasyABC')
+sys.path.append(EASYABC_DIR)
+import xml2abc
+from file_utils import iter_files, read_xml
+
+
+def xml2abc_in_process(file):
+    # same options as "xml2abc.py -d 8 -c 6 -x", without starting an interpreter
+    abc_text, _ = xml2abc.vertaal(read_xml(file), d=8, c=6, x=1, ped=1)
+    return abc_text + '\n' if abc_text else ''
+
+
+def convert_xml2abc_one(args):
+    # returns the error log line on failure, None otherwise
+    file, des_folder, use_subprocess = args
+    cmd = [sys.executable, os.path.join(EASYABC_DIR, 'xml2abc.py'), '-d', '8', '-c', '6', '-x']
+    filename = os.path.basename(file)
+    output_path = os.path.join(des_folder, filename.rsplit('.', 1)[0] + '.abc')
+    if os.path.exists(output_path):
+        return
+
+    try:
+        if use_subprocess:
+            p = subprocess.run(cmd + [file], stdout=subprocess.PIPE)
+            output = p.stdout.decode('utf-8')
+        else:
+            output = xml2abc_in_process(file)
+
+        if output == '':
+            return file + '\n'
+        else:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(output)
+    except Exception as e:
+        return file + ' ' + str(e) + '\n'
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Batch convert MusicXML/MXL files to ABC notation.")
     parser.add_argument('-i', '--input_dir', required=True, help='Input directory containing XML/MXL files')
     parser.add_argument('-o', '--output_dir', required=True, help='Output directory for ABC files')
+    parser.add_argument('--subprocess', action='store_true', help='Run xml2abc.py in a new interpreter per file')
     args = parser.parse_args()
 
     ori_folder = args.input_dir
     des_folder = args.output_dir
 
-    file_list = []
     os.makedirs("logs", exist_ok=True)
+    os.makedirs(des_folder, exist_ok=True)
 
-    for root, dirs, files in os.walk(os.path.abspath(ori_folder)):
-        for file in files:
-            if file.endswith((".mxl", ".xml", ".musicxml")):
-                filename = os.path.join(root, file).replace("\\", "/")
-                file_list.append(filename)
+    file_list = [path.replace("\\", "/") for path in iter_files(os.path.abspath(ori_folder), (".mxl", ".xml", ".musicxml"))]
 
-    random.shuffle(file_list)
     num_files = len(file_list)
-    num_processes = os.cpu_count()
-    file_lists = [file_list[i::num_processes] for i in range(num_processes)]
+    # small batches lose to worker start-up, so never start more workers than files
+    num_processes = max(1, min(os.cpu_count() or 1, num_files))
+    tasks = ((file, des_folder, args.subprocess) for file in file_list)
 
-    with Pool(processes=num_processes) as pool:
-        pool.starmap(convert_xml2abc, [(chunk, des_folder) for chunk in file_lists])
+    # fork lets workers inherit the interpreter instead of re-importing this module
+    ctx = multiprocessing.get_context('fork' if sys.platform != 'win32' else 'spawn')
+    # workers only report failures; the parent is the single writer of the log
+    with ctx.Pool(processes=num_processes) as pool, \
+            open("logs/xml2abc_error_log.txt", "a", encoding="utf-8") as error_log:
+        # one file per task, so a few huge scores cannot hold back a whole pre-split chunk
+        for failure in tqdm(pool.imap_unordered(convert_xml2abc_one, tasks, chunksize=16), total=num_files):
+            if failure:
+                error_log.write(failure)
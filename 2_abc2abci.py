@@ -2,6 +2,7 @@ import os
 import re
 import argparse
 from tqdm import tqdm
+from multiprocessing import Pool
 from abctoolkit.utils import (
     remove_information_field, 
     remove_bar_no_annotations, 
@@ -13,12 +14,42 @@ from abctoolkit.utils import (
 from abctoolkit.convert import unidecode_abc_lines
 from abctoolkit.rotate import rotate_abc
 from abctoolkit.check import check_alignment_unrotated
-from abctoolkit.transpose import Key2index, transpose_an_abc_text
+from abctoolkit.transpose import Key2index, prepare_abc_text_to_transpose, transpose_a_prepared_abc_text
+
+
+_HDR_RE = re.compile(r'^[A-Za-z]:')
+_QUOTE_RE = re.compile(Quote_re)
+_RUN_RE = re.compile(r'([^a-zA-Z0-9])\1+')
+
+_made_dirs = set()  # output folders already created by this process
+
+
+def _makedirs_once(path):
+    if path not in _made_dirs:
+        os.makedirs(path, exist_ok=True)
+        _made_dirs.add(path)
+
+
+def _assemble_reduced_lines(prefix_dict, left_barline_dict, bar_text_dict, right_barline_dict):
+    # one interleaved line per bar, keeping only the voices that play in that bar
+    reduced_lines = []
+    for i in range(len(bar_text_dict['V:1'])):
+        parts = []
+        for symbol in prefix_dict.keys():
+            if any(ch.isalpha() and ch not in 'ZzXx' for ch in bar_text_dict[symbol][i]):
+                if i == 0:
+                    part_patch = f'[{symbol}]{prefix_dict[symbol]}{left_barline_dict[symbol][0]}{bar_text_dict[symbol][0]}{right_barline_dict[symbol][0]}'
+                else:
+                    part_patch = f'[{symbol}]{bar_text_dict[symbol][i]}{right_barline_dict[symbol][i]}'
+                parts.append(part_patch)
+        parts.append('\n')
+        reduced_lines.append(''.join(parts))
+    return reduced_lines
 
 
 def abc_preprocess_pipeline(abc_path, interleaved_folder, augmented_folder=None):
     with open(abc_path, 'r', encoding='utf-8') as f:
-        abc_lines = [line for line in f.readlines() if line.strip()]
+        abc_lines = [line for line in f if line.strip()]
 
     abc_lines = unidecode_abc_lines(abc_lines)
     abc_lines = remove_information_field(
@@ -27,14 +58,26 @@ def abc_preprocess_pipeline(abc_path, interleaved_folder, augmented_folder=None)
     )
     abc_lines = remove_bar_no_annotations(abc_lines)
 
+    # single pass: strip \" outside headers/comments, drop quotes holding barlines,
+    # drop empty quotes and compact ^/_ annotations
     for i, line in enumerate(abc_lines):
-        if not re.search(r'^[A-Za-z]:', line) and not line.startswith('%'):
-            abc_lines[i] = line.replace(r'\"', '')
-
-    for i, line in enumerate(abc_lines):
-        for quote_content in re.findall(Quote_re, line):
-            if any(barline in quote_content for barline in Barlines):
-                abc_lines[i] = line.replace(quote_content, '')
+        if '"' not in line:
+            continue
+        is_header = _HDR_RE.match(line) or line.startswith('%')
+        if not is_header:
+            line = line.replace(r'\"', '')
+        for match in _QUOTE_RE.findall(line):
+            if any(barline in match for barline in Barlines):
+                line = line.replace(match, '')
+            elif match == '""':
+                line = line.replace(match, '')
+            elif match[1] in ['^', '_']:
+                sub_string = _RUN_RE.sub(r'\1', match)
+                if len(sub_string) <= 40:
+                    line = line.replace(match, sub_string)
+                else:
+                    line = line.replace(match, '')
+        abc_lines[i] = line
 
     try:
         _, ok, _ = check_alignment_unrotated(abc_lines)
@@ -43,18 +86,6 @@ def abc_preprocess_pipeline(abc_path, interleaved_folder, augmented_folder=None)
     except Exception:
         raise Exception(f"Alignment error in {abc_path}")
 
-    for i, line in enumerate(abc_lines):
-        for match in re.findall(r'"[^"]*"', line):
-            if match == '""':
-                line = line.replace(match, '')
-            if match[1] in ['^', '_']:
-                sub_string = re.sub(r'([^a-zA-Z0-9])\1+', r'\1', match)
-                if len(sub_string) <= 40:
-                    line = line.replace(match, sub_string)
-                else:
-                    line = line.replace(match, '')
-        abc_lines[i] = line
-
     abc_name = os.path.splitext(os.path.basename(abc_path))[0]
     metadata_lines, part_text_dict = extract_metadata_and_parts(abc_lines)
     global_metadata_dict, _ = extract_global_and_local_metadata(metadata_lines)
@@ -63,36 +94,37 @@ def abc_preprocess_pipeline(abc_path, interleaved_folder, augmented_folder=None)
     interleaved_abc = rotate_abc(abc_lines)
     interleaved_path = os.path.join(interleaved_folder, abc_name + '.abc')
     with open(interleaved_path, 'w', encoding='utf-8') as w:
-        w.writelines(interleaved_abc)
+        w.write(''.join(interleaved_abc))
 
     if augmented_folder:
+        # metadata / part split and per-voice keys do not depend on the target key
+        prepared_abc_text = prepare_abc_text_to_transpose(abc_lines)
         for key in Key2index.keys():
-            transposed_abc_text = transpose_an_abc_text(abc_lines, key)
+            transposed_abc_text = transpose_a_prepared_abc_text(prepared_abc_text, key)
             transposed_abc_lines = [line + '\n' for line in transposed_abc_text.split('\n') if line.strip()]
             metadata_lines, prefix_dict, left_barline_dict, bar_text_dict, right_barline_dict = \
                 extract_barline_and_bartext_dict(transposed_abc_lines)
 
-            reduced_abc_lines = metadata_lines
-            for i in range(len(bar_text_dict['V:1'])):
-                line = ''
-                for symbol in prefix_dict.keys():
-                    if any(ch.isalpha() and ch not in 'ZzXx' for ch in bar_text_dict[symbol][i]):
-                        if i == 0:
-                            part_patch = f'[{symbol}]{prefix_dict[symbol]}{left_barline_dict[symbol][0]}{bar_text_dict[symbol][0]}{right_barline_dict[symbol][0]}'
-                        else:
-                            part_patch = f'[{symbol}]{bar_text_dict[symbol][i]}{right_barline_dict[symbol][i]}'
-                        line += part_patch
-                line += '\n'
-                reduced_abc_lines.append(line)
+            reduced_abc_lines = metadata_lines + _assemble_reduced_lines(
+                prefix_dict, left_barline_dict, bar_text_dict, right_barline_dict)
 
             reduced_path = os.path.join(augmented_folder, key, f"{abc_name}_{key}.abc")
-            os.makedirs(os.path.dirname(reduced_path), exist_ok=True)
+            _makedirs_once(os.path.dirname(reduced_path))
             with open(reduced_path, 'w', encoding='utf-8') as w:
-                w.writelines(reduced_abc_lines)
+                w.write(''.join(reduced_abc_lines))
 
     return abc_name, ori_key
 
 
+def _worker(args):
+    abc_path, interleaved_folder, augmented_folder = args
+    try:
+        abc_preprocess_pipeline(abc_path, interleaved_folder, augmented_folder)
+    except Exception as e:
+        return abc_path, str(e)
+    return None
+
+
 def main():
     parser = argparse.ArgumentParser(description="Preprocess ABC files with interleaving, augmentation, and key extraction.")
     parser.add_argument('-i', '--input_dir', required=True, help='Input directory containing ABC files')
@@ -107,15 +139,17 @@ def main():
     os.makedirs(interleaved_folder, exist_ok=True)
     if augmented_folder:
         for key in Key2index.keys():
-            os.makedirs(os.path.join(augmented_folder, key), exist_ok=True)
-
-    for file in tqdm(os.listdir(ori_folder)):
-        abc_path = os.path.join(ori_folder, file)
-        try:
-            abc_preprocess_pipeline(abc_path, interleaved_folder, augmented_folder)
-        except Exception as e:
-            print(abc_path, 'failed:', e)
-            continue
+            _makedirs_once(os.path.join(augmented_folder, key))
+
+    tasks = [(os.path.join(ori_folder, file), interleaved_folder, augmented_folder)
+             for file in os.listdir(ori_folder)]
+
+    num_proc = os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (num_proc * 4))
+    with Pool(processes=num_proc) as pool:
+        for failure in tqdm(pool.imap_unordered(_worker, tasks, chunksize=chunksize), total=len(tasks)):
+            if failure:
+                print(failure[0], 'failed:', failure[1])
 
 
 
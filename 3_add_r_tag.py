@@ -1,27 +1,33 @@
 import os
 import argparse
+from multiprocessing import Pool
+from file_utils import iter_files
 
 def process_abc_file(in_path, out_path):
-    with open(in_path, "r", encoding="utf-8") as f:
+    # tags are ASCII, so work on bytes and skip the UTF-8 decode/encode
+    with open(in_path, "rb") as f:
         lines = f.readlines()
 
-    body_lines = [i for i, line in enumerate(lines) if line.strip().startswith("[")]
-    total = len(body_lines)
+    total = sum(1 for line in lines if line.strip().startswith(b"["))
     if total == 0:
         return
 
     new_lines = []
     count = 1
-    for i, line in enumerate(lines):
-        if i in body_lines:
-            new_lines.append(f"[r:{count}/{total-count}]{line}")
+    for line in lines:
+        if line.strip().startswith(b"["):
+            new_lines.append(b"[r:%d/%d]%s" % (count, total - count, line))
             count += 1
         else:
             new_lines.append(line)
 
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.writelines(new_lines)
+    with open(out_path, "wb") as f:
+        f.write(b"".join(new_lines))
+
+
+def _worker(args):
+    process_abc_file(*args)
 
 
 def main():
@@ -33,13 +39,14 @@ def main():
     in_dir = os.path.abspath(args.input_dir)
     out_dir = os.path.abspath(args.output_dir)
 
-    for root, _, files in os.walk(in_dir):
-        for name in files:
-            if name.lower().endswith(".abc"):
-                in_path = os.path.join(root, name)
-                rel_path = os.path.relpath(in_path, in_dir)
-                out_path = os.path.join(out_dir, rel_path)
-                process_abc_file(in_path, out_path)
+    tasks = [(in_path, os.path.join(out_dir, os.path.relpath(in_path, in_dir)))
+             for in_path in iter_files(in_dir, (".abc",), ignore_case=True)]
+
+    num_proc = os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (num_proc * 4))
+    with Pool(processes=num_proc) as pool:
+        for _ in pool.imap_unordered(_worker, tasks, chunksize=chunksize):
+            pass
 
 if __name__ == "__main__":
     main()
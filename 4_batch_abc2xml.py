@@ -1,42 +1,51 @@
 import os
-import random
+import sys
 import argparse
 import subprocess
+import multiprocessing
 from tqdm import tqdm
-from multiprocessing import Pool
 
+EASYABC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "EasyABC")
+sys.path.append(EASYABC_DIR)
+import abc2xml
+from file_utils import iter_files
 
-def convert_abc2xml(file_list, des_folder):
-    cmd = "python utils/abc2xml.py "
-    os.makedirs(des_folder, exist_ok=True)
 
-    for file in tqdm(file_list):
-        filename = os.path.basename(file)
-        output_path = os.path.join(
-            des_folder,
-            ".".join(filename.split(".")[:-1]) + ".xml"
-        )
+def abc2xml_in_process(file):
+    # same output as "abc2xml.py <file>", without starting an interpreter
+    abc_text = abc2xml.readfile(file)
+    xml_docs = abc2xml.getXmlDocs(abc_text, 0, 1)
+    abc2xml.getInfo()  # drop the diagnostics collected for this file
+    return "".join(abc2xml.fixDoctype(doc) + "\n" for doc in xml_docs)
+
 
-        try:
-            p = subprocess.Popen(
-                cmd + '"' + file + '"',
-                stdout=subprocess.PIPE,
-                shell=True
-            )
-            result = p.communicate()
-            output = result[0].decode("utf-8")
+def convert_abc2xml_one(args):
+    # returns the error log line on failure, None otherwise
+    file, des_folder, use_subprocess = args
+    cmd = [sys.executable, os.path.join(EASYABC_DIR, "abc2xml.py")]
+    filename = os.path.basename(file)
+    output_path = os.path.join(
+        des_folder,
+        ".".join(filename.split(".")[:-1]) + ".xml"
+    )
+    if os.path.exists(output_path):
+        return
 
-            if output.strip() == "":
-                with open("logs/abc2xml_error_log.txt", "a", encoding="utf-8") as f:
-                    f.write(file + "\n")
-                continue
+    try:
+        if use_subprocess:
+            p = subprocess.run(cmd + [file], stdout=subprocess.PIPE)
+            output = p.stdout.decode("utf-8")
+        else:
+            output = abc2xml_in_process(file)
 
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(output)
+        if output.strip() == "":
+            return file + "\n"
 
-        except Exception as e:
-            with open("logs/abc2xml_error_log.txt", "a", encoding="utf-8") as f:
-                f.write(file + " " + str(e) + "\n")
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(output)
+
+    except Exception as e:
+        return file + " " + str(e) + "\n"
 
 
 if __name__ == "__main__":
@@ -45,28 +54,28 @@ if __name__ == "__main__":
     )
     parser.add_argument( "-i", "--input_dir", required=True, help="Input directory containing ABC files",)
     parser.add_argument( "-o", "--output_dir", required=True, help="Output directory for XML files",)
+    parser.add_argument("--subprocess", action="store_true", help="Run abc2xml.py in a new interpreter per file")
     args = parser.parse_args()
 
     ori_folder = os.path.abspath(args.input_dir)
     des_folder = os.path.abspath(args.output_dir)
 
     os.makedirs("logs", exist_ok=True)
-
-    file_list = []
+    os.makedirs(des_folder, exist_ok=True)
 
     # Collect ABC files
-    for root, _, files in os.walk(ori_folder):
-        for file in files:
-            if not file.lower().endswith(".abc"):
-                continue
-            filename = os.path.join(root, file).replace("\\", "/")
-            file_list.append(filename)
-
-    random.shuffle(file_list)
-
-    num_proc = os.cpu_count() or 1
-    # split file_list into num_proc chunks
-    chunks = [file_list[i::num_proc] for i in range(num_proc)]
-
-    with Pool(processes=num_proc) as pool:
-        pool.starmap(convert_abc2xml, [(chunk, des_folder) for chunk in chunks])
+    file_list = [path.replace("\\", "/") for path in iter_files(ori_folder, (".abc",), ignore_case=True)]
+
+    # small batches lose to worker start-up, so never start more workers than files
+    num_proc = max(1, min(os.cpu_count() or 1, len(file_list)))
+    tasks = ((file, des_folder, args.subprocess) for file in file_list)
+
+    # fork lets workers inherit the interpreter instead of re-importing this module
+    ctx = multiprocessing.get_context("fork" if sys.platform != "win32" else "spawn")
+    # workers only report failures; the parent is the single writer of the log
+    with ctx.Pool(processes=num_proc) as pool, \
+            open("logs/abc2xml_error_log.txt", "a", encoding="utf-8") as error_log:
+        # one file per task, so a few huge scores cannot hold back a whole pre-split chunk
+        for failure in tqdm(pool.imap_unordered(convert_abc2xml_one, tasks, chunksize=16), total=len(file_list)):
+            if failure:
+                error_log.write(failure)
@@ -1,6 +1,7 @@
 import os
 import math
 import subprocess
+from functools import lru_cache
 from tqdm import trange
 from multiprocessing import Pool
 from unidecode import unidecode
@@ -70,12 +71,17 @@ def unidecode_abc(args):
             w.write(abc_text)
 
 
+# 各文件间大量重复的行（如 M:4/4、L:1/8、K:C）直接命中缓存
+_unidecode_line = lru_cache(maxsize=16384)(unidecode)
+
+
 def unidecode_abc_lines(abc_lines: list):
     # 只返回unidecode结果，不写入文件
     unideccoded_abc_lines = []
 
     for line in abc_lines:
-        unideccoded_abc_lines.append(unidecode(line))
+        # 纯ASCII行unidecode后不变，无需转换
+        unideccoded_abc_lines.append(line if line.isascii() else _unidecode_line(line))
 
     return unideccoded_abc_lines
 
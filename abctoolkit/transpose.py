@@ -549,8 +549,10 @@ def transpose_a_voice(abc_text, ori_keymode, des_key):
     return transposed_abc_text
 
 
-def transpose_an_abc_text(abc_text_lines, des_key):
-
+def prepare_abc_text_to_transpose(abc_text_lines):
+    '''
+    提取与目标调无关的部分（metadata、各声部文本、各声部原调），转多个调时只需计算一次
+    '''
     metadata_lines, part_text_dict = extract_metadata_and_parts(abc_text_lines)
     global_metadata_dict, local_metadata_dict = extract_global_and_local_metadata(metadata_lines)
     global_key = global_metadata_dict['K'][0]
@@ -563,6 +565,15 @@ def transpose_an_abc_text(abc_text_lines, des_key):
         elif 'K' not in local_metadata_dict[symbol].keys():
             local_metadata_dict[symbol]['K'] = global_key
 
+    return metadata_lines, part_text_dict, global_key, local_metadata_dict
+
+
+def transpose_a_prepared_abc_text(prepared_abc_text, des_key):
+    '''
+    prepared_abc_text: prepare_abc_text_to_transpose 的返回值
+    '''
+    metadata_lines, part_text_dict, global_key, local_metadata_dict = prepared_abc_text
+
     transposed_abc_text = ''
     # 开始转调
     for line in metadata_lines:
@@ -591,6 +602,11 @@ def transpose_an_abc_text(abc_text_lines, des_key):
     return transposed_abc_text
 
 
+def transpose_an_abc_text(abc_text_lines, des_key):
+
+    return transpose_a_prepared_abc_text(prepare_abc_text_to_transpose(abc_text_lines), des_key)
+
+
 def transpose_to_abc_lines(abc_lines, key):
 
     transposed_abc_text = transpose_an_abc_text(abc_lines, key)
@@ -15,11 +15,19 @@ Brace_re = r'\{[^}]+\}'
 
 
 def find_all_abc(directory):
-    for root, directories, files in os.walk(directory):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            if file_path.endswith('.abc') or file_path.endswith('txt'):
-                yield file_path
+    # os.scandir 直接从 readdir 拿到文件类型，不必再逐个 stat
+    stack = [directory]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue  # 目录已被删除或不可读，和 os.walk 一样跳过
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(('.abc', 'txt')):
+                    yield entry.path
 
 
 def extract_metadata_and_tunebody(abc_lines: list):
@@ -356,14 +364,8 @@ def extract_a_part(abc_lines: list, part: str):
 
 def remove_information_field(abc_lines: list, info_fields: list):
     # info_fields: ['X:', 'T:', 'C:', '%%MIDI', ...]
-    filtered_abc_lines = []
-    for line in abc_lines:
-        save_flag = True
-        for symbol in info_fields:
-            if line.startswith(symbol):
-                save_flag = False
-        if save_flag:
-            filtered_abc_lines.append(line)
+    info_fields = tuple(info_fields)
+    filtered_abc_lines = [line for line in abc_lines if not line.startswith(info_fields)]
 
     return filtered_abc_lines
 
@@ -1,4 +1,5 @@
 import argparse
+import json
 import subprocess
 from pathlib import Path
 from multiprocessing import Pool
@@ -9,20 +10,24 @@ import tempfile
 
 # NOTE: This path is macOS-specific. Adjust for other operating systems.
 MUSESCORE_CLI = "/Applications/MuseScore 4.app/Contents/MacOS/mscore"
+# Max number of scores converted per MuseScore launch (one "-j" job file)
+MUSESCORE_BATCH_SIZE = 500
 
 script_dir = Path(__file__).parent
 sys.path.append(str(script_dir))
 sys.path.append(str(script_dir / "EasyABC"))
 sys.path.append(str(script_dir / "abctoolkit"))
 
+from file_utils import iter_files, read_xml
+
 # --- 1. Core Single-Step Processing Functions ---
 
 def musescore_convert(input_path: Path, output_path: Path):
     if not Path(MUSESCORE_CLI).exists():
         raise FileNotFoundError(f"MuseScore not found at: {MUSESCORE_CLI}")
     
-    command = f'"{MUSESCORE_CLI}" -o "{str(output_path.absolute())}" "{str(input_path.absolute())}"'
-    process = subprocess.run(command, capture_output=True, text=True, shell=True)
+    command = [MUSESCORE_CLI, "-o", str(output_path.absolute()), str(input_path.absolute())]
+    process = subprocess.run(command, capture_output=True, text=True)
     
     if process.returncode != 0 or not output_path.exists():
         error_message = process.stderr or process.stdout
@@ -41,9 +46,33 @@ def midi2mp3(input_path: Path, output_path: Path):
     musescore_convert(input_path, output_path)
 
 def xml2abc(input_path: Path, output_path: Path):
+    import xml2abc as xml2abc_lib
+    # Same options as "xml2abc.py -d 8 -c 6 -m 0 -x -n 1000000 -b 1000000", without a new interpreter
+    abc_text, info = xml2abc_lib.vertaal(read_xml(input_path), d=8, c=6, m=0, x=1, n=1000000, b=1000000, ped=1)
+
+    if not abc_text:
+        raise RuntimeError(f"xml2abc produced no output: {info.strip()}")
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(abc_text + '\n')
+
+def abc2xml(input_path: Path, output_path: Path):
+    import abc2xml as abc2xml_lib
+    abc_text = abc2xml_lib.readfile(str(input_path))
+    xml_docs = abc2xml_lib.getXmlDocs(abc_text, 0, 1) if abc_text else []
+    info = abc2xml_lib.getInfo()  # Also clears the messages collected for this file
+
+    if not xml_docs:
+        raise RuntimeError(f"abc2xml produced no output: {info.strip()}")
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(''.join(abc2xml_lib.fixDoctype(doc) + '\n' for doc in xml_docs))
+
+def xml2abc_subprocess(input_path: Path, output_path: Path):
     script_path = script_dir / "EasyABC" / "xml2abc.py"
-    command = f'python "{script_path}" -d 8 -c 6 -m 0 -x -n 1000000 -b 1000000 "{str(input_path.absolute())}"'
-    result = subprocess.run(command, capture_output=True, text=True, shell=True)
+    command = [sys.executable, str(script_path), "-d", "8", "-c", "6", "-m", "0", "-x",
+               "-n", "1000000", "-b", "1000000", str(input_path.absolute())]
+    result = subprocess.run(command, capture_output=True, text=True)
     
     if result.returncode != 0:
         raise RuntimeError(f"xml2abc.py failed: {result.stderr}")
@@ -54,7 +83,7 @@ def xml2abc(input_path: Path, output_path: Path):
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(result.stdout)
 
-def abc2xml(input_path: Path, output_path: Path):
+def abc2xml_subprocess(input_path: Path, output_path: Path):
     script_path = script_dir / "EasyABC" / "abc2xml.py"
     
     # Patch for abc2xml.py requiring a .abc extension
@@ -62,8 +91,8 @@ def abc2xml(input_path: Path, output_path: Path):
         with open(input_path, 'r', encoding='utf-8') as f_in:
             temp_input_file.write(f_in.read())
         temp_input_file.flush()
-        command = f'python "{script_path}" "{temp_input_file.name}"'
-        result = subprocess.run(command, capture_output=True, text=True, shell=True)
+        command = [sys.executable, str(script_path), temp_input_file.name]
+        result = subprocess.run(command, capture_output=True, text=True)
 
     if result.returncode != 0:
         raise RuntimeError(f"abc2xml.py failed: {result.stderr}")
@@ -77,18 +106,21 @@ def abc2xml(input_path: Path, output_path: Path):
 def abc2abci(input_path: Path, output_path: Path):
     from abctoolkit.rotate import rotate_abc
     with open(input_path, 'r', encoding='utf-8') as f:
-        abc_lines = [line for line in f.readlines() if line.strip()]
+        abc_lines = [line for line in f if line.strip()]
     interleaved_lines = rotate_abc(abc_lines)
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.writelines(interleaved_lines)
+        f.write(''.join(interleaved_lines))
 
 def abci2abc(input_path: Path, output_path: Path):
     from abctoolkit.rotate import unrotate_abc
     with open(input_path, 'r', encoding='utf-8') as f:
-        abci_lines = [line for line in f.readlines() if line.strip()]
+        abci_lines = [line for line in f if line.strip()]
     abc_lines = unrotate_abc(abci_lines)
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.writelines(abc_lines)
+        f.write(''.join(abc_lines))
+
+# Steps that only call musescore_convert, so they can share one MuseScore launch per batch
+MUSESCORE_STEPS = (midi2xml, xml2midi, xml2mp3, midi2mp3)
 
 # --- 2. Batch Processor Framework ---
 
@@ -104,6 +136,42 @@ def _process_wrapper(args):
         with open(log_file, "a", encoding="utf-8") as f:
             f.write(f"Error processing {input_path}: {e}\n")
 
+def _process_musescore_batch(args):
+    tasks, log_file = args
+    tasks = [(input_path, output_path) for input_path, output_path in tasks if not output_path.exists()]
+    if not tasks:
+        return
+
+    errors = []
+    if Path(MUSESCORE_CLI).exists():
+        job = [{"in": str(input_path.absolute()), "out": str(output_path.absolute())}
+               for input_path, output_path in tasks]
+        with tempfile.NamedTemporaryFile(mode='w', suffix=".json", delete=False, encoding='utf-8') as job_file:
+            json.dump(job, job_file)
+        try:
+            process = subprocess.run([MUSESCORE_CLI, "-j", job_file.name], capture_output=True, text=True)
+        finally:
+            os.remove(job_file.name)
+        missing = sum(1 for _, output_path in tasks if not output_path.exists())
+        if missing:
+            # Logged once per job rather than repeated on every failed file
+            errors.append(f"MuseScore job of {len(tasks)} files left {missing} outputs missing: "
+                          f"{(process.stderr or process.stdout).strip()}")
+
+    # MuseScore reports a job file as a whole, so retry what it did not write one file at a time
+    for input_path, output_path in tasks:
+        if output_path.exists():
+            continue
+        try:
+            musescore_convert(input_path, output_path)
+        except Exception as e:
+            errors.append(f"Error processing {input_path}: {e}")
+
+    if errors:
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(log_file, "a", encoding="utf-8") as f:
+            f.write("".join(error + "\n" for error in errors))
+
 class BatchProcessor:
     def __init__(self, input_dir, output_dir, in_globs, out_suffix, process_function):
         self.input_dir = Path(input_dir)
@@ -116,14 +184,15 @@ class BatchProcessor:
     def _setup_directories(self):
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+    def _find_input_files(self):
+        # One walk for all globs instead of one rglob per pattern
+        suffixes = tuple(glob_pattern.lstrip('*').lower() for glob_pattern in self.in_globs)
+        return [Path(path) for path in iter_files(str(self.input_dir), suffixes, ignore_case=True)]
+
     def run(self):
         self._setup_directories()
         
-        files_to_process = []
-        for glob_pattern in self.in_globs:
-            files_to_process.extend(self.input_dir.rglob(glob_pattern))
-        
-        files_to_process = sorted(list(set(files_to_process)))
+        files_to_process = self._find_input_files()
 
         if not files_to_process:
             print(f"No files found matching {self.in_globs} in {self.input_dir}. Exiting step.")
@@ -138,14 +207,29 @@ class BatchProcessor:
             output_path.parent.mkdir(parents=True, exist_ok=True)
             tasks.append((input_path, output_path, self.process_function, self.log_file))
 
-        with Pool(os.cpu_count()) as pool:
-            list(tqdm(pool.imap_unordered(_process_wrapper, tasks), total=len(tasks)))
+        if self.process_function in MUSESCORE_STEPS:
+            self._run_musescore_batches(tasks)
+        else:
+            # Send tasks in chunks to cut pipe round-trips; recycle workers to cap memory growth
+            num_proc = os.cpu_count() or 1
+            chunksize = max(1, len(tasks) // (num_proc * 8))
+            with Pool(num_proc, maxtasksperchild=1000) as pool:
+                list(tqdm(pool.imap_unordered(_process_wrapper, tasks, chunksize=chunksize), total=len(tasks)))
         
         print(f"Step complete. Output in: {self.output_dir}")
         if self.log_file.exists():
             print(f"Errors logged in: {self.log_file}")
         return True
 
+    def _run_musescore_batches(self, tasks):
+        # Spread the files over the workers, but never more than MUSESCORE_BATCH_SIZE per job file
+        num_proc = os.cpu_count() or 1
+        batch_size = max(1, min(MUSESCORE_BATCH_SIZE, -(-len(tasks) // num_proc)))
+        batches = [([(input_path, output_path) for input_path, output_path, _, _ in tasks[i:i + batch_size]], self.log_file)
+                   for i in range(0, len(tasks), batch_size)]
+        with Pool(min(num_proc, len(batches))) as pool:
+            list(tqdm(pool.imap_unordered(_process_musescore_batch, batches), total=len(batches), unit="batch"))
+
 
 # --- 3. Main Entry Point & Chain Execution ---
 
@@ -156,18 +240,21 @@ def main():
     parser.add_argument("-o", "--output_dir", required=True, help="Final output directory.")
     parser.add_argument("-t", "--temp_dir", help="Optional: Specify a directory for temporary files.")
     parser.add_argument("--keep_temp", action="store_true", help="Keep the temporary directory for debugging.")
+    parser.add_argument("--subprocess", action="store_true", help="Run xml2abc.py/abc2xml.py in a new interpreter per file.")
     args = parser.parse_args()
 
     xml_exts = ["*.xml", "*.mxl", "*.musicxml"]
+    xml2abc_func = xml2abc_subprocess if args.subprocess else xml2abc
+    abc2xml_func = abc2xml_subprocess if args.subprocess else abc2xml
 
     step_definitions = {
         "midi2xml": {"func": midi2xml, "in_globs": "*.mid",  "out_suffix": ".mxl"},
         "xml2midi": {"func": xml2midi, "in_globs": xml_exts, "out_suffix": ".mid"},
-        "xml2abc":  {"func": xml2abc,  "in_globs": xml_exts, "out_suffix": ".abc"},
-        "abc2xml":  {"func": abc2xml,  "in_globs": "*.abc",  "out_suffix": ".xml"},
+        "xml2abc":  {"func": xml2abc_func, "in_globs": xml_exts, "out_suffix": ".abc"},
+        "abc2xml":  {"func": abc2xml_func, "in_globs": "*.abc",  "out_suffix": ".xml"},
         "abc2abci": {"func": abc2abci, "in_globs": "*.abc",  "out_suffix": ".abci"},
         "abci2abc": {"func": abci2abc, "in_globs": "*.abci", "out_suffix": ".abc"},
-        "abci2xml": {"func": abc2xml,  "in_globs": "*.abci", "out_suffix": ".xml"},
+        "abci2xml": {"func": abc2xml_func, "in_globs": "*.abci", "out_suffix": ".xml"},
         "xml2mp3":  {"func": xml2mp3,  "in_globs": xml_exts, "out_suffix": ".mp3"},
         "midi2mp3": {"func": midi2mp3, "in_globs": "*.mid",  "out_suffix": ".mp3"},
     }
@@ -0,0 +1,32 @@
+import os
+from zipfile import ZipFile
+
+
+def iter_files(directory, suffixes, ignore_case=False):
+    # os.scandir gets the entry type from readdir, so no extra stat per entry
+    stack = [directory]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue  # removed or unreadable since it was listed; os.walk skips these too
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    name = entry.name.lower() if ignore_case else entry.name
+                    if name.endswith(suffixes):
+                        yield entry.path
+
+
+def read_xml(file):
+    # MusicXML bytes; for .mxl, the MusicXML member of the archive (as xml2abc.py picks it)
+    if str(file).lower().endswith('.mxl'):
+        with ZipFile(file) as z:
+            for n in z.namelist():
+                if n[:4] != 'META' and n.lower().endswith(('.xml', '.musicxml')):
+                    return z.read(n)
+        raise RuntimeError('no MusicXML file in archive')
+    with open(file, 'rb') as f:
+        return f.read()
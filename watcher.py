@@ -4,22 +4,39 @@
 
 import os
 import sys
+import json
 import time
 import shutil
 import argparse
 import traceback
 import subprocess
 import tempfile
+import threading
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from pathlib import Path
 from typing import Optional, Tuple
 
+try:  # optional: sleep on filesystem events instead of polling
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
 ROOT = Path(__file__).resolve().parent
+sys.path.append(str(ROOT / 'EasyABC'))
+from file_utils import iter_files
 DEFAULT_MUSESCORE_PATHS = [
     "/Applications/MuseScore 4.app/Contents/MacOS/mscore",
     "/Applications/MuseScore 3.app/Contents/MacOS/mscore",
 ]
+_log_lock = threading.Lock()  # batch_build compiles from several threads
+# Resolved once instead of walking $PATH on every audio export
+FFMPEG = shutil.which("ffmpeg")
+AFCONVERT = shutil.which("afconvert")
 
+@lru_cache(maxsize=None)
 def find_musescore(explicit: Optional[str] = None) -> str:
     if explicit and Path(explicit).exists():
         return explicit
@@ -46,7 +63,25 @@ def run_cmd(cmd: list, timeout: int = 180) -> Tuple[str, str]:
         raise RuntimeError(f"Failed: {' '.join(cmd)}\n{err.decode('utf-8', 'ignore')}")
     return out.decode("utf-8", "ignore"), err.decode("utf-8", "ignore")
 
-def abc_to_musicxml(abc_path: Path, xml_path: Path, py: str) -> None:
+def abc_to_musicxml(abc_path: Path, xml_path: Path, py: Optional[str]) -> None:
+    if py is None:
+        # Same output as "abc2xml.py <file>", without starting an interpreter.
+        # abc2xml keeps its parse state in module globals: one conversion per process at a time.
+        import abc2xml
+        abc_text = abc2xml.readfile(str(abc_path))
+        xml_docs = abc2xml.getXmlDocs(abc_text, 0, 1) if abc_text else []
+        abc2xml.getInfo()  # drop the diagnostics collected for this file
+        out = "".join(abc2xml.fixDoctype(doc) + "\n" for doc in xml_docs)
+    else:
+        out = abc_to_musicxml_subprocess(abc_path, py)
+
+    if not out.strip():
+        raise RuntimeError(f"Empty MusicXML output: {abc_path}")
+    
+    xml_path.parent.mkdir(parents=True, exist_ok=True)
+    xml_path.write_text(out, encoding="utf-8")
+
+def abc_to_musicxml_subprocess(abc_path: Path, py: str) -> str:
     script = ROOT / 'EasyABC' / "abc2xml.py"
     if not script.exists():
         raise FileNotFoundError(f"Missing abc2xml.py at {script}")
@@ -57,26 +92,19 @@ def abc_to_musicxml(abc_path: Path, xml_path: Path, py: str) -> None:
         
         # Call abc2xml.py with the temporary .abc file
         out, _ = run_cmd([py, str(script), temp_input_file.name])
-
-    if not out.strip():
-        raise RuntimeError(f"Empty MusicXML output: {abc_path}")
-    
-    xml_path.parent.mkdir(parents=True, exist_ok=True)
-    xml_path.write_text(out, encoding="utf-8")
+    return out
 
 def musicxml_to_pdf(mscore_bin: str, xml_path: Path, pdf_path: Path) -> None:
     pdf_path.parent.mkdir(parents=True, exist_ok=True)
     run_cmd([mscore_bin, "-o", str(pdf_path), str(xml_path)])
 
 def _convert_wav_to_mp3(wav_path: Path, mp3_path: Path) -> None:
-    ffmpeg = shutil.which("ffmpeg")
-    if ffmpeg:
-        run_cmd([ffmpeg, "-y", "-i", str(wav_path), str(mp3_path)])
+    if FFMPEG:
+        run_cmd([FFMPEG, "-y", "-i", str(wav_path), str(mp3_path)])
         return
-    afc = shutil.which("afconvert")
-    if afc:
+    if AFCONVERT:
         tmp_aac = wav_path.with_suffix(".m4a")
-        run_cmd([afc, "-f", "m4af", "-d", "aac", str(wav_path), str(tmp_aac)])
+        run_cmd([AFCONVERT, "-f", "m4af", "-d", "aac", str(wav_path), str(tmp_aac)])
         tmp_aac.rename(mp3_path)
         return
     raise RuntimeError("No audio converter found (ffmpeg/afconvert).")
@@ -101,55 +129,178 @@ def musicxml_to_mp3(mscore_bin: str, xml_path: Path, mp3_path: Path) -> None:
 def log_error(root: Path, src: Path, err: Exception) -> None:
     logs = root / "logs"
     logs.mkdir(exist_ok=True)
-    with (logs / "watch_errors.log").open("a", encoding="utf-8") as f:
+    with _log_lock, (logs / "watch_errors.log").open("a", encoding="utf-8") as f:
         f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}  {src}\n")
         f.write("".join(traceback.format_exception(err)))
         f.write("\n")
 
-def compile_one(mscore_bin: str, py: str, abc_file: Path, out_dir: Path, root: Path, build_audio: bool) -> Optional[Path]:
+def output_paths(abc_file: Path, out_dir: Path) -> Tuple[Path, Path, Path]:
+    stem = abc_file.stem
+    return out_dir / f"{stem}.musicxml", out_dir / f"{stem}.pdf", out_dir / f"{stem}.mp3"
+
+def up_to_date(abc_file: Path, out_dir: Path, build_audio: bool) -> bool:
+    # Outputs on disk outlive the in-memory state, so a restart does not rebuild everything
+    _, pdf_path, mp3_path = output_paths(abc_file, out_dir)
+    outputs = [pdf_path, mp3_path] if build_audio else [pdf_path]
     try:
-        stem = abc_file.stem
-        xml_path = out_dir / f"{stem}.musicxml"
-        pdf_path = out_dir / f"{stem}.pdf"
+        src_mtime = abc_file.stat().st_mtime
+        return all(p.stat().st_mtime >= src_mtime for p in outputs)
+    except FileNotFoundError:
+        return False
+
+def print_ok(abc_file: Path, pdf_path: Path, mp3_path: Path, root: Path, build_audio: bool) -> None:
+    if build_audio:
+        print(f"[OK] {abc_file.relative_to(root)} -> {pdf_path.relative_to(root)}, {mp3_path.relative_to(root)}")
+    else:
+        print(f"[OK] {abc_file.relative_to(root)} -> {pdf_path.relative_to(root)}")
+
+def compile_one(mscore_bin: str, py: Optional[str], abc_file: Path, out_dir: Path, root: Path, build_audio: bool) -> Optional[Path]:
+    try:
+        xml_path, pdf_path, mp3_path = output_paths(abc_file, out_dir)
+        if up_to_date(abc_file, out_dir, build_audio):
+            return pdf_path
         abc_to_musicxml(abc_file, xml_path, py)
         musicxml_to_pdf(mscore_bin, xml_path, pdf_path)
         if build_audio:
-            mp3_path = out_dir / f"{stem}.mp3"
             musicxml_to_mp3(mscore_bin, xml_path, mp3_path)
-            print(f"[OK] {abc_file.relative_to(root)} -> {pdf_path.relative_to(root)}, {mp3_path.relative_to(root)}")
-        else:
-            print(f"[OK] {abc_file.relative_to(root)} -> {pdf_path.relative_to(root)}")
+        print_ok(abc_file, pdf_path, mp3_path, root, build_audio)
+        return pdf_path
+    except Exception as e:
+        print(f"[ERR] {abc_file.relative_to(root)}")
+        log_error(root, abc_file, e)
+        return None
+
+def musescore_jobs(mscore_bin: str, jobs: list, build_audio: bool, root: Path) -> None:
+    # One MuseScore launch renders a batch of (xml, pdf, mp3) jobs; stale outputs are re-rendered by finish_one
+    job = [{"in": str(xml_path), "out": [str(pdf_path), str(mp3_path)] if build_audio else str(pdf_path)}
+           for xml_path, pdf_path, mp3_path in jobs]
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False, encoding="utf-8") as job_file:
+        json.dump(job, job_file)
+    try:
+        run_cmd([mscore_bin, "-j", job_file.name], timeout=180 * len(jobs))
+    except RuntimeError as e:
+        # The job file is gone after this call, so name the scores it held
+        xml_list = ", ".join(str(xml_path) for xml_path, _, _ in jobs)
+        log_error(root, jobs[0][0].parent, RuntimeError(f"MuseScore job failed for {xml_list}: {e}"))
+    finally:
+        os.unlink(job_file.name)
+
+def finish_one(mscore_bin: str, abc_file: Path, out_dir: Path, root: Path, build_audio: bool) -> Optional[Path]:
+    # Falls back to one MuseScore launch per output the job file did not (re)write
+    try:
+        xml_path, pdf_path, mp3_path = output_paths(abc_file, out_dir)
+        src_mtime = abc_file.stat().st_mtime
+
+        def stale(p: Path) -> bool:
+            return not p.exists() or p.stat().st_mtime < src_mtime
+
+        if stale(pdf_path):
+            musicxml_to_pdf(mscore_bin, xml_path, pdf_path)
+        if build_audio and stale(mp3_path):
+            musicxml_to_mp3(mscore_bin, xml_path, mp3_path)
+        print_ok(abc_file, pdf_path, mp3_path, root, build_audio)
         return pdf_path
     except Exception as e:
         print(f"[ERR] {abc_file.relative_to(root)}")
         log_error(root, abc_file, e)
         return None
 
-def scan_and_build(mscore_bin: str, py: str, src_dir: Path, out_dir: Path, root: Path, build_audio: bool, state: dict) -> None:
-    for p in src_dir.rglob("*"):
-        if p.suffix in {".abc", ".abci"}:
-            if not p.is_file():
-                continue
+def scan_and_build(mscore_bin: str, py: Optional[str], src_dir: Path, out_dir: Path, root: Path, build_audio: bool, state: dict) -> None:
+    for path in iter_files(str(src_dir), (".abc", ".abci")):
+        p = Path(path)
+        mtime = p.stat().st_mtime
+        if p not in state or mtime > state[p]:
+            compile_one(mscore_bin, py, p, out_dir, root, build_audio)
+            state[p] = mtime
+
+def watch_events(mscore_bin: str, py: Optional[str], src_dir: Path, out_dir: Path, root: Path, build_audio: bool, state: dict) -> None:
+    def build_if_changed(p: Path) -> None:
+        try:
             mtime = p.stat().st_mtime
-            if p not in state or mtime > state[p]:
-                compile_one(mscore_bin, py, p, out_dir, root, build_audio)
-                state[p] = mtime
+        except FileNotFoundError:
+            return
+        # One save usually fires several events; only the first one after a change compiles
+        if p not in state or mtime > state[p]:
+            compile_one(mscore_bin, py, p, out_dir, root, build_audio)
+            state[p] = mtime
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory or event.event_type not in ("created", "modified", "moved"):
+                return
+            path = event.dest_path if event.event_type == "moved" else event.src_path  # editors often save by rename
+            if path.endswith((".abc", ".abci")):
+                ex.submit(build_if_changed, Path(path))
+
+    # A single worker keeps compiles in order and off the observer thread
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        observer = Observer()
+        observer.schedule(Handler(), str(src_dir), recursive=True)
+        observer.start()
+        try:
+            while observer.is_alive():
+                observer.join(1)
+        finally:
+            observer.stop()
+            observer.join()
 
-def batch_build(mscore_bin: str, py: str, src_dir: Path, out_dir: Path, root: Path, build_audio: bool, quiet: bool) -> dict:
-    abc_files = [p for p in src_dir.rglob("*.abc") if p.is_file()]
+def batch_build(mscore_bin: str, py: Optional[str], src_dir: Path, out_dir: Path, root: Path, build_audio: bool, quiet: bool, jobs: int) -> dict:
+    abc_files = sorted(Path(path) for path in iter_files(str(src_dir), (".abc",)))  # stable pick on stem clashes
     state = {}
     if not abc_files:
         print("No .abc found; watching…")
         return state
-    if quiet:
-        for p in abc_files:
-            compile_one(mscore_bin, py, p, out_dir, root, build_audio)
+    stale = []
+    claimed = {}
+    collided = 0
+    for p in abc_files:
+        # Outputs are named by stem only, so a/x.abc and b/x.abc would write the same files; the first one owns them
+        xml_path = output_paths(p, out_dir)[0]
+        if xml_path in claimed:
+            print(f"[ERR] {p.relative_to(root)}")
+            log_error(root, p, RuntimeError(f"Output {xml_path.name} already built from {claimed[xml_path].relative_to(root)}; skipped"))
             state[p] = p.stat().st_mtime
+            collided += 1
+            continue
+        claimed[xml_path] = p
+        if up_to_date(p, out_dir, build_audio):
+            state[p] = p.stat().st_mtime  # so the first scan does not rebuild it either
+        else:
+            stale.append(p)
+    converted = []
+    # In-process abc2xml is not thread-safe, so it gets worker processes, no more than there are CPUs
+    # for the CPU-bound parse; --python runs child processes already, so threads just wait on them
+    if py is None:
+        export_pool = ProcessPoolExecutor(max_workers=min(jobs, os.cpu_count() or 1))
     else:
-        print(f"Discovered {len(abc_files)} .abc files")
-        for p in tqdm(abc_files):
-            compile_one(mscore_bin, py, p, out_dir, root, build_audio)
+        export_pool = ThreadPoolExecutor(max_workers=jobs)
+    with export_pool as ex:
+        futures = {ex.submit(abc_to_musicxml, p, output_paths(p, out_dir)[0], py): p for p in stale}
+        done = as_completed(futures)
+        if not quiet:
+            fresh = len(abc_files) - len(stale) - collided
+            print(f"Discovered {len(abc_files)} .abc files ({fresh} up to date, {collided} skipped for clashing names)")
+            # Coarse refreshes: with parallel compiles, per-item terminal writes add up
+            done = tqdm(done, total=len(futures), miniters=max(1, len(futures) // 200), mininterval=0.25)
+        for fut in done:
+            p = futures[fut]
             state[p] = p.stat().st_mtime
+            try:
+                fut.result()
+                converted.append(p)
+            except Exception as e:
+                print(f"[ERR] {p.relative_to(root)}")
+                log_error(root, p, e)
+
+    if converted:
+        # Render PDFs/MP3s through about `jobs` MuseScore launches instead of one or two per file;
+        # old outputs stay in place until they are overwritten
+        renders = [output_paths(p, out_dir) for p in converted]
+        batch_size = -(-len(renders) // jobs)
+        batches = [renders[i:i + batch_size] for i in range(0, len(renders), batch_size)]
+        with ThreadPoolExecutor(max_workers=jobs) as ex:
+            list(ex.map(lambda batch: musescore_jobs(mscore_bin, batch, build_audio, root), batches))
+            list(ex.map(lambda p: finish_one(mscore_bin, p, out_dir, root, build_audio), converted))
     return state
 
 def parse_args() -> argparse.Namespace:
@@ -157,11 +308,16 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--src", type=Path, default=ROOT, help="Source directory (default: script dir)")
     ap.add_argument("--out", type=Path, default=ROOT / "build", help="Output directory (default: ./build)")
     ap.add_argument("--mscore", type=str, default=None, help="MuseScore CLI path (overrides detection)")
-    ap.add_argument("--python", type=str, default=sys.executable, help="Python executable to run abc2xml.py")
+    ap.add_argument("--python", type=str, default=None, help="Run abc2xml.py with this Python per file (default: convert in-process)")
     ap.add_argument("--interval", type=float, default=2.0, help="Seconds between scans (default 2s)")
+    ap.add_argument("--poll", action="store_true", help="Poll every --interval seconds even if watchdog is installed")
     ap.add_argument("--no-audio", action="store_true", help="Disable audio export")
     ap.add_argument("--quiet", action="store_true", help="Silent batch build (no tqdm)")
-    return ap.parse_args()
+    ap.add_argument("--jobs", type=int, default=min(32, (os.cpu_count() or 1) * 2), help="Parallel MusicXML exports and MuseScore renders in the batch build")
+    args = ap.parse_args()
+    if args.jobs < 1:
+        ap.error("--jobs must be at least 1")
+    return args
 
 def main():
     args = parse_args()
@@ -174,13 +330,18 @@ def main():
     print(f"Source   : {src_dir}")
     print(f"Output   : {out_dir}")
     print(f"Audio    : {'on (MP3)' if build_audio else 'off'}")
-    print(f"Interval : {args.interval}s")
-    state = batch_build(mscore_bin, args.python, src_dir, out_dir, root, build_audio, quiet=args.quiet)
-    print(f"Watching {src_dir} (check every {args.interval}s)  Ctrl+C to quit")
+    use_events = Observer is not None and not args.poll
+    print(f"Interval : {'events (watchdog)' if use_events else f'{args.interval}s'}")
+    state = batch_build(mscore_bin, args.python, src_dir, out_dir, root, build_audio, quiet=args.quiet, jobs=args.jobs)
     try:
-        while True:
-            scan_and_build(mscore_bin, args.python, src_dir, out_dir, root, build_audio, state)
-            time.sleep(args.interval)
+        if use_events:
+            print(f"Watching {src_dir} (filesystem events)  Ctrl+C to quit")
+            watch_events(mscore_bin, args.python, src_dir, out_dir, root, build_audio, state)
+        else:
+            print(f"Watching {src_dir} (check every {args.interval}s)  Ctrl+C to quit")
+            while True:
+                scan_and_build(mscore_bin, args.python, src_dir, out_dir, root, build_audio, state)
+                time.sleep(args.interval)
     except KeyboardInterrupt:
         print("\nStopped.")
 